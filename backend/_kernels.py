@@ -0,0 +1,128 @@
+from __future__ import annotations
+import math
+import numpy as np
+
+# Numba is optional: without it these stay plain Python/NumPy functions.
+# Kernels are nogil so concurrent requests can run them on separate cores.
+try:
+    from numba import njit, prange  # type: ignore
+    HAVE_NUMBA = True
+except Exception:
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+# Kernels take float32 coordinate arrays; R only multiplies the final
+# 2*asin(sqrt(a)), so that output (not the ranking) is where metres appear.
+R_EARTH_M = 6371000.0
+
+@njit(fastmath=True, cache=True, nogil=True)
+def hav(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Haversine distance in metres between two (lat, lon) points in degrees."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dlmb/2)**2
+    return 2*R_EARTH_M*math.asin(math.sqrt(a))
+
+# Plain NumPy: only the no-Numba fallback below calls it.
+def hav_vec(lats: np.ndarray, lons: np.ndarray, lat: float, lon: float) -> np.ndarray:
+    """Haversine metres from each (lats[i], lons[i]) to (lat, lon); all in degrees."""
+    p1 = np.radians(lats)
+    p2 = math.radians(lat)
+    dphi = p2 - p1
+    dlmb = math.radians(lon) - np.radians(lons)
+    a = np.sin(dphi*0.5)**2 + np.cos(p1)*math.cos(p2)*np.sin(dlmb*0.5)**2
+    return 2*R_EARTH_M*np.arcsin(np.sqrt(a))
+
+def _potential_batch_np(nodes, lat, lon, lm_from, lm_to, s, t):
+    h_t = hav_vec(lat[nodes], lon[nodes], lat[t], lon[t])
+    h_s = hav_vec(lat[nodes], lon[nodes], lat[s], lon[s])
+    if lm_from.shape[1]:
+        f_v, t_v = lm_from[nodes], lm_to[nodes]
+        # fmax skips NaN, so a row with no usable landmark keeps the haversine bound
+        h_t = np.fmax(h_t, np.fmax.reduce(np.fmax(lm_from[t] - f_v, t_v - lm_to[t]), axis=1))
+        h_s = np.fmax(h_s, np.fmax.reduce(np.fmax(f_v - lm_from[s], lm_to[s] - t_v), axis=1))
+    return 0.5 * (h_t - h_s)
+
+# No fastmath here: unreachable landmark entries are NaN and must compare False.
+@njit(cache=True, nogil=True)
+def _potential_batch_jit(nodes, lat, lon, lm_from, lm_to, s, t):
+    out = np.empty(nodes.shape[0])
+    for j in range(nodes.shape[0]):
+        v = nodes[j]
+        h_t = hav(lat[v], lon[v], lat[t], lon[t])
+        h_s = hav(lat[v], lon[v], lat[s], lon[s])
+        for k in range(lm_from.shape[1]):
+            b = lm_from[t, k] - lm_from[v, k]
+            if b > h_t:
+                h_t = b
+            b = lm_to[v, k] - lm_to[t, k]
+            if b > h_t:
+                h_t = b
+            b = lm_from[v, k] - lm_from[s, k]
+            if b > h_s:
+                h_s = b
+            b = lm_to[s, k] - lm_to[v, k]
+            if b > h_s:
+                h_s = b
+        out[j] = 0.5 * (h_t - h_s)
+    return out
+
+def potential_batch(nodes: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                    lm_from: np.ndarray, lm_to: np.ndarray, s: int, t: int) -> np.ndarray:
+    """
+    Bidirectional A* potential p(v) = (h(v, t) - h(v, s)) / 2 for each v in nodes.
+    Each h is the larger of the haversine bound and the ALT landmark bound
+    d(v, t) >= max_k(L_from[t,k] - L_from[v,k], L_to[v,k] - L_to[t,k]);
+    pass (N, 0) landmark arrays for haversine only.
+    """
+    if HAVE_NUMBA:
+        return _potential_batch_jit(nodes, lat, lon, lm_from, lm_to, s, t)
+    return _potential_batch_np(nodes, lat, lon, lm_from, lm_to, s, t)
+
+@njit(cache=True, fastmath=True, parallel=True, nogil=True)
+def nearest_idx(lat: float, lon: float, lats_rad: np.ndarray, lons_rad: np.ndarray,
+                cos_lats: np.ndarray) -> int:
+    """
+    Index of the stored point closest to (lat, lon) in degrees. The stored points
+    are given in radians together with their precomputed cos(lat).
+    """
+    n = lats_rad.shape[0]
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    cos_lat_r = math.cos(lat_r)
+    # One chunk per thread, then reduce the per-chunk minima serially.
+    n_chunks = 64 if n >= 64 else max(n, 1)
+    best_a = np.full(n_chunks, np.inf)
+    best_i = np.zeros(n_chunks, dtype=np.int64)
+    for c in prange(n_chunks):
+        lo = c * n // n_chunks
+        hi = (c + 1) * n // n_chunks
+        for i in range(lo, hi):
+            dphi = lats_rad[i] - lat_r
+            dlmb = lons_rad[i] - lon_r
+            a = math.sin(dphi/2)**2 + cos_lat_r*cos_lats[i]*math.sin(dlmb/2)**2
+            if a < best_a[c]:
+                best_a[c] = a
+                best_i[c] = i
+    k = 0
+    for c in range(1, n_chunks):
+        if best_a[c] < best_a[k]:
+            k = c
+    return best_i[k]
+
+if HAVE_NUMBA:
+    # Warm the JIT (and the on-disk cache) at import, not on the first request.
+    # graph_loader hands out read-only arrays, which Numba types separately.
+    hav(0.0, 0.0, 0.0, 0.0)
+    _f32 = np.zeros(1, dtype=np.float32)
+    _no_lm = np.empty((1, 0), dtype=np.float32)
+    _f32.setflags(write=False)
+    _no_lm.setflags(write=False)
+    _potential_batch_jit(np.zeros(1, dtype=np.int64), _f32, _f32, _no_lm, _no_lm, 0, 0)
+    # nearest_idx is not warmed: nearest_node only reaches it without sklearn
+    # and scipy, so it compiles lazily on first use instead of on every import.
@@ -1,11 +1,15 @@
 # backend/app.py
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Tuple
+import hashlib
 import os
+import threading
 import traceback
-import re
 
 from flask import Flask, request, render_template
 from flask_cors import CORS
@@ -18,9 +22,16 @@ try:
 except Exception:
     pass
 
-import networkx as nx
+import numpy as np
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from urllib3.util.retry import Retry
+
+try:
+    import diskcache  # type: ignore
+except Exception:
+    diskcache = None
 
 from graph_loader import load_graph, nearest_node
 from routing import (
@@ -37,14 +48,37 @@ CORS(app)
 # ---------- Paths ----------
 ROOT_DIR = Path(__file__).resolve().parents[1]
 STATIC_DIR = ROOT_DIR / "static"
-MAP_HTML = STATIC_DIR / "route_map.html"
+MAP_CACHE_MAX = 64  # route_<hash>.html files kept in STATIC_DIR
+# Kept out of STATIC_DIR so the cache DB is not served by Flask.
+GEOCODE_CACHE_DIR = Path(__file__).resolve().parent / "cache" / "geocode"
+GEOCODE_CACHE_TTL_S = 86400 * 30
+GEOCODE_MEMO_MAX = 4096  # in-process geocode results, in front of the disk cache
+SERVER_THREADS = 8  # waitress worker threads, see __main__
 
 # ---------- Load road graph ----------
-G: nx.MultiDiGraph = load_graph()
+G = load_graph()  # GraphBundle from the .npz, else a DiGraph parsed from GraphML
 
 # ---------- Geocoder ----------
-geolocator = Nominatim(user_agent="kl-shortest-route-demo")
+# RequestsAdapter keeps one requests.Session (and its pooled, TLS-warm
+# connections) for the geolocator's lifetime. Only Nominatim is contacted, so
+# one host pool; it holds a connection per server thread, since RateLimiter
+# below spaces out call starts (1 request/s) but slow calls may still overlap.
+geolocator = Nominatim(
+    user_agent="kl-shortest-route-demo",
+    adapter_factory=partial(
+        RequestsAdapter,
+        pool_connections=1,
+        pool_maxsize=SERVER_THREADS,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    ),
+)
 geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1.0, swallow_exceptions=True)
+geocache = diskcache.Cache(str(GEOCODE_CACHE_DIR)) if diskcache is not None else None
+# Only real misses come here (see route_endpoint), at most one per request, so
+# one worker per server thread means a miss never queues behind another's.
+geocode_pool = ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix="geocode")
+_geo_memo: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+_geo_memo_lock = threading.Lock()
 
 # ---------- Flexible geocoding ----------
 _KL_VIEWBOX = {  # rough bbox for Klang Valley
@@ -63,7 +97,22 @@ ALIASES = {
     "TIMES SQUARE": "Berjaya Times Square, Kuala Lumpur",
 }
 
-coord_pat = re.compile(r"^\s*(-?\d+(\.\d+)?)\s*,\s*(-?\d+(\.\d+)?)\s*$")
+def _is_decimal(t: str) -> bool:
+    """One number in the old coord_pat grammar: optional '-', digits, optional '.digits'. No '+', '_', exponent or inf/nan."""
+    body = t[1:] if t.startswith("-") else t
+    whole, dot, frac = body.partition(".")
+    return whole.isdecimal() and (not dot or frac.isdecimal())
+
+
+def _parse_latlon(s: str) -> Optional[Tuple[float, float]]:
+    """'lat,lon' -> (lat, lon), else None. Whitespace around either number is allowed."""
+    parts = s.split(",")
+    if len(parts) != 2:
+        return None
+    lat_s, lon_s = parts[0].strip(), parts[1].strip()
+    if not (_is_decimal(lat_s) and _is_decimal(lon_s)):
+        return None
+    return float(lat_s), float(lon_s)
 
 
 def _try_geocode(q: str, *, country_bias=True, viewbox_bias=True):
@@ -95,12 +144,65 @@ def _try_geocode(q: str, *, country_bias=True, viewbox_bias=True):
     return geocode(q, exactly_one=True, language="en", addressdetails=False)
 
 
-def resolve_place_to_latlon(q: str) -> Tuple[float, float]:
+def _geocode_key(s_aug: str) -> str:
+    return " ".join(s_aug.split()).casefold()
+
+
+def _remember_geocode(key: str, latlon: Tuple[float, float]) -> None:
+    with _geo_memo_lock:
+        _geo_memo[key] = latlon
+        _geo_memo.move_to_end(key)
+        if len(_geo_memo) > GEOCODE_MEMO_MAX:
+            _geo_memo.popitem(last=False)
+
+
+def _cached_geocode(key: str) -> Optional[Tuple[float, float]]:
+    """Earlier result for key from the in-process LRU, then the disk cache; never calls Nominatim."""
+    with _geo_memo_lock:
+        hit = _geo_memo.get(key)
+        if hit is not None:
+            _geo_memo.move_to_end(key)
+            return hit
+    if geocache is None:
+        return None
+    hit = geocache.get(key)
+    if hit is not None:
+        _remember_geocode(key, hit)
+    return hit
+
+
+def _geocode_latlon(s: str, s_aug: str) -> Tuple[float, float]:
+    """
+    Geocode with the biased fallbacks, memoized in-process and on disk so that
+    cache hits never reach Nominatim (or the RateLimiter sleep).
+    Raises LookupError on a miss; failures are not cached.
+    """
+    key = _geocode_key(s_aug)
+    hit = _cached_geocode(key)
+    if hit is not None:
+        return hit
+
+    loc = (
+        _try_geocode(s_aug, country_bias=True, viewbox_bias=True)
+        or _try_geocode(s_aug, country_bias=True, viewbox_bias=False)
+        or _try_geocode(s, country_bias=False, viewbox_bias=False)
+    )
+    if not loc:
+        raise LookupError(s_aug)
+    latlon = (float(loc.latitude), float(loc.longitude))
+    if geocache is not None:
+        geocache.set(key, latlon, expire=GEOCODE_CACHE_TTL_S)
+    _remember_geocode(key, latlon)
+    return latlon
+
+
+def resolve_place_to_latlon(q: str, *, cached_only: bool = False) -> Optional[Tuple[float, float]]:
     """
     Resolve user text to (lat, lon). Supports:
       - aliases (UPM/KLCC/KLIA, etc.)
       - raw 'lat,lon'
       - Malaysia/KL-biased search with global fallback
+    With cached_only, returns None instead of querying Nominatim.
     """
     s = q.strip()
     if not s:
@@ -112,21 +214,49 @@ def resolve_place_to_latlon(q: str) -> Tuple[float, float]:
         s = ALIASES[up]
 
     # Raw coordinates "lat,lon"
-    m = coord_pat.match(s)
-    if m:
-        return float(m.group(1)), float(m.group(3))
+    latlon = _parse_latlon(s)
+    if latlon:
+        return latlon
 
     # Add locality hint if missing
     s_aug = s if ("Malaysia" in s or "Kuala Lumpur" in s) else f"{s}, Kuala Lumpur, Malaysia"
 
-    loc = (
-        _try_geocode(s_aug, country_bias=True, viewbox_bias=True)
-        or _try_geocode(s_aug, country_bias=True, viewbox_bias=False)
-        or _try_geocode(s, country_bias=False, viewbox_bias=False)
-    )
-    if not loc:
+    if cached_only:
+        return _cached_geocode(_geocode_key(s_aug))
+    try:
+        return _geocode_latlon(s, s_aug)
+    except LookupError:
         raise ValueError(f"Could not geocode: {q!r}. Try adding 'Kuala Lumpur' or use 'lat,lon'.")
-    return float(loc.latitude), float(loc.longitude)
+
+
+def _route_map_name(coords: List[Tuple[float, float]], a_label: str, b_label: str) -> str:
+    """Content-addressed map file name; the labels go into the popups, so they are hashed too."""
+    h = hashlib.blake2b(np.asarray(coords, dtype=np.float32).tobytes(), digest_size=16)
+    h.update(a_label.encode("utf-8") + b"\0" + b_label.encode("utf-8"))
+    return f"route_{h.hexdigest()}.html"
+
+
+def _cached_route_map(coords: List[Tuple[float, float]], a_label: str, b_label: str) -> str:
+    """Render the Folium map only if this route isn't on disk yet; returns the path relative to STATIC_DIR."""
+    name = _route_map_name(coords, a_label, b_label)
+    path = STATIC_DIR / name
+    try:
+        os.utime(path)  # bump for LRU eviction
+        return name
+    except FileNotFoundError:
+        pass  # not rendered yet, or another request just evicted it
+
+    tmp = path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    render_folium_map(coords, a_label, b_label, str(tmp))
+    os.replace(tmp, path)
+
+    try:
+        maps = sorted(STATIC_DIR.glob("route_*.html"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in maps[MAP_CACHE_MAX:]:
+            old.unlink(missing_ok=True)
+    except OSError:
+        pass  # raced with another request's eviction
+    return name
 
 
 @app.get("/")
@@ -146,9 +276,16 @@ def route_endpoint():
         if not point_a or not point_b:
             return render_template("index.html", error="Both Point A and Point B are required."), 400
 
-        # Geocode
-        a_lat, a_lon = resolve_place_to_latlon(point_a)
-        b_lat, b_lon = resolve_place_to_latlon(point_b)
+        # Geocode: aliases, raw coords and cache hits resolve right here; only
+        # real misses go to Nominatim, and if both miss, A overlaps with B.
+        a = resolve_place_to_latlon(point_a, cached_only=True)
+        b = resolve_place_to_latlon(point_b, cached_only=True)
+        fut_a = geocode_pool.submit(resolve_place_to_latlon, point_a) if a is None and b is None else None
+        if b is None:
+            b = resolve_place_to_latlon(point_b)
+        if a is None:
+            a = fut_a.result() if fut_a is not None else resolve_place_to_latlon(point_a)
+        (a_lat, a_lon), (b_lat, b_lon) = a, b
 
         # Snap & route
         src = nearest_node(G, a_lat, a_lon)
@@ -158,12 +295,12 @@ def route_endpoint():
         # Distance + map
         dist_m = route_total_length_m(G, node_route)
         coords = route_coordinates(G, node_route)
-        render_folium_map(coords, point_a, point_b, str(MAP_HTML))
+        map_rel_path = _cached_route_map(coords, point_a, point_b)
 
         return render_template(
             "result.html",
             distance_km=f"{dist_m/1000:.2f}",
-            map_rel_path="route_map.html",
+            map_rel_path=map_rel_path,
             point_a=point_a,
             point_b=point_b
         )
@@ -177,4 +314,12 @@ def route_endpoint():
 if __name__ == "__main__":
     os.environ.setdefault("PYTHONIOENCODING", "utf-8")
     app.config["JSON_AS_ASCII"] = False
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    try:
+        from waitress import serve  # type: ignore
+    except Exception:
+        # Dev fallback: Werkzeug, threaded so requests still overlap
+        app.run(host="127.0.0.1", port=5000, debug=True, threaded=True)
+    else:
+        # Multi-threaded WSGI server: the NumPy/Numba phases of concurrent
+        # /route requests release the GIL and run in parallel.
+        serve(app, host="127.0.0.1", port=5000, threads=SERVER_THREADS)
@@ -1,36 +1,311 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import List
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 import math
 import networkx as nx
+import numpy as np
+
+from _kernels import HAVE_NUMBA, nearest_idx
+
+# Spatial index for nearest-node lookup: BallTree (haversine) if sklearn is
+# available, else a cKDTree over equirectangular-projected coords.
+try:
+    from sklearn.neighbors import BallTree  # type: ignore
+except Exception:
+    BallTree = None
+try:
+    from scipy.spatial import cKDTree  # type: ignore
+except Exception:
+    cKDTree = None
 
 GRAPH_CACHE = Path(__file__).resolve().parent / "kl_drive.graphml"
 
 _node_ids: List = []
 _node_lat: List[float] = []
 _node_lon: List[float] = []
+_node_ids_arr: np.ndarray = np.empty(0, dtype=object)
+_id2idx: Dict = {}
+_coord_arr: np.ndarray = np.empty((0, 2), dtype=np.float32)  # (lat, lon) degrees per node index
+# float32 halves the bytes per scan and doubles SIMD width. Its step near KL is
+# ~0.76 m for lon in radians (~1.77 rad) and ~0.85 m for lon in degrees (~101),
+# so a scan over these arrays may pick a node a fraction of a metre farther
+# than the true nearest; sub-metre is fine for snapping a click to a road.
+_node_lat_rad: np.ndarray = np.empty(0, dtype=np.float32)
+_node_lon_rad: np.ndarray = np.empty(0, dtype=np.float32)
+_node_cos_lat: np.ndarray = np.empty(0, dtype=np.float32)  # graph constant, saves a cos per node per query
+_node_tree = None
+_proj_cos_lat0: float = 1.0
+_KDTREE_CANDIDATES = 8
+N_LANDMARKS = 16
 
-def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371000.0
-    from math import radians, sin, cos, asin, sqrt
+class CSRGraph(NamedTuple):
+    """Integer-indexed adjacency (CSR); node i is node_ids[i], row i lists its successors."""
+    node_ids: np.ndarray            # object, idx -> original node id
+    id_to_idx: Dict                 # original node id -> idx
+    coords: np.ndarray              # float32 (N, 2) (lat, lon) degrees, ~0.85 m step in lon
+    lat: np.ndarray                 # float32 degrees, contiguous copy of coords[:, 0]
+    lon: np.ndarray                 # float32 degrees, contiguous copy of coords[:, 1]
+    indptr: np.ndarray              # int32, shape (N+1,)
+    indices: np.ndarray             # int32, shape (E,), sorted within each row
+    weights: np.ndarray             # float32, shape (E,), min length over parallel edges
+    rindptr: np.ndarray             # reverse graph (predecessors), same layout
+    rindices: np.ndarray
+    rweights: np.ndarray
+    # ALT landmark distances, float32 (N, K), NaN where unreachable
+    lm_from: Optional[np.ndarray] = None    # d(landmark_k, v)
+    lm_to: Optional[np.ndarray] = None      # d(v, landmark_k)
+
+def _haversine_rank(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Haversine 'a' term; monotone in distance, so fine for ranking candidates."""
+    from math import radians, sin, cos
     dphi = radians(lat2 - lat1)
     dlmb = radians(lon2 - lon1)
     p1, p2 = radians(lat1), radians(lat2)
-    a = sin(dphi/2)**2 + cos(p1)*cos(p2)*sin(dlmb/2)**2
-    return 2*R*asin(sqrt(a))
+    return sin(dphi/2)**2 + cos(p1)*cos(p2)*sin(dlmb/2)**2
+
+def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    R = 6371000.0
+    return 2*R*math.asin(math.sqrt(_haversine_rank(lat1, lon1, lat2, lon2)))
 
-def _prep_node_arrays(G: nx.MultiDiGraph) -> None:
-    """Cache arrays for fast nearest-node lookup."""
-    global _node_ids, _node_lat, _node_lon
-    _node_ids, _node_lat, _node_lon = [], [], []
+def _prep_node_arrays(G: nx.DiGraph) -> None:
+    """Cache arrays and a spatial index for fast nearest-node lookup."""
+    ids, lat, lon = [], [], []
     for n, data in G.nodes(data=True):
-        _node_ids.append(n)
-        _node_lat.append(float(data["y"]))
-        _node_lon.append(float(data["x"]))
+        ids.append(n)
+        lat.append(float(data["y"]))
+        lon.append(float(data["x"]))
+    _prep_node_arrays_from(ids, lat, lon)
+
+def _prep_node_arrays_from(ids: List, lat: List[float], lon: List[float]) -> None:
+    """_prep_node_arrays from node ids and their (lat, lon) in degrees, index-aligned."""
+    global _node_ids, _node_lat, _node_lon, _node_ids_arr, _node_tree, _proj_cos_lat0
+    global _node_lat_rad, _node_lon_rad, _node_cos_lat, _id2idx, _coord_arr
+    _node_ids, _node_lat, _node_lon = ids, lat, lon
+
+    _node_ids_arr = np.asarray(_node_ids, dtype=object)
+    _id2idx = {n: i for i, n in enumerate(_node_ids)}
+    _coord_arr = np.column_stack([_node_lat, _node_lon]).astype(np.float32).reshape(-1, 2)
+    coords_rad = np.radians(np.column_stack([_node_lat, _node_lon])) if _node_ids else np.empty((0, 2))
+    _node_lat_rad = np.ascontiguousarray(coords_rad[:, 0], dtype=np.float32)
+    _node_lon_rad = np.ascontiguousarray(coords_rad[:, 1], dtype=np.float32)
+    _node_cos_lat = np.cos(coords_rad[:, 0]).astype(np.float32)
+    _node_tree = None
+    if not _node_ids:
+        return
+    # The trees copy to float64 internally anyway; build them from the exact coords
+    if BallTree is not None:
+        _node_tree = BallTree(coords_rad, metric="haversine")
+    elif cKDTree is not None:
+        # Equirectangular projection around the mean latitude; fine at city scale.
+        _proj_cos_lat0 = math.cos(float(coords_rad[:, 0].mean()))
+        _node_tree = cKDTree(np.column_stack([coords_rad[:, 0], coords_rad[:, 1] * _proj_cos_lat0]))
+
+def _collapse_parallel_edges(G: nx.MultiDiGraph) -> nx.DiGraph:
+    """Plain DiGraph where each (u,v) keeps only 'length' = min over its parallel edges."""
+    min_len: Dict = {}
+    for u, v, d in G.edges(data=True):
+        w = d["length"]
+        if w < min_len.get((u, v), float("inf")):
+            min_len[(u, v)] = w
+    Gs = nx.DiGraph()
+    Gs.graph.update(G.graph)
+    Gs.add_nodes_from(G.nodes(data=True))
+    Gs.add_weighted_edges_from(((u, v, w) for (u, v), w in min_len.items()), weight="length")
+    return Gs
+
+def _compressed_undirected(G: nx.DiGraph) -> nx.Graph:
+    """
+    Make an undirected, weighted view where each edge (u,v) has weight=min length
+    of the directed edges u->v and v->u.
+    """
+    UG = nx.Graph()
+    # copy node coordinates
+    for n, d in G.nodes(data=True):
+        UG.add_node(n, y=float(d["y"]), x=float(d["x"]))
+    for u, v, d in G.edges(data=True):
+        w = float(d.get("length", float("inf")))
+        if UG.has_edge(u, v):
+            if w < float(UG[u][v]["length"]):
+                UG[u][v]["length"] = w
+        else:
+            UG.add_edge(u, v, length=w)
+    return UG
+
+def _build_csr(G: nx.Graph) -> CSRGraph:
+    """CSR adjacency over _node_ids order (G has no parallel edges after load_graph)."""
+    id_to_idx = _id2idx
+    indptr = np.zeros(len(_node_ids) + 1, dtype=np.int32)
+    nbr_idx: List[int] = []
+    nbr_w: List[float] = []
+    for i, u in enumerate(_node_ids):
+        row = []
+        for v, w in G.adj[u].items():
+            row.append((id_to_idx[v], w["length"]))
+        row.sort()
+        nbr_idx.extend(j for j, _ in row)
+        nbr_w.extend(length for _, length in row)
+        indptr[i + 1] = len(nbr_idx)
+    return _csr_from_arrays(indptr, np.asarray(nbr_idx, dtype=np.int32), np.asarray(nbr_w, dtype=np.float32))
+
+def _csr_from_arrays(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray) -> CSRGraph:
+    """Wrap forward CSR arrays over _node_ids order and derive the transposed ones."""
+    # Transpose for the backward search: sort edges by (head, tail)
+    tails = np.repeat(np.arange(len(_node_ids), dtype=np.int32), np.diff(indptr))
+    order = np.lexsort((tails, indices))
+    rindptr = np.zeros(len(_node_ids) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(indices, minlength=len(_node_ids)), out=rindptr[1:])
+    return CSRGraph(
+        node_ids=_node_ids_arr,
+        id_to_idx=_id2idx,
+        coords=_coord_arr,
+        lat=np.ascontiguousarray(_coord_arr[:, 0]),
+        lon=np.ascontiguousarray(_coord_arr[:, 1]),
+        indptr=indptr,
+        indices=indices,
+        weights=weights,
+        rindptr=rindptr,
+        rindices=tails[order],
+        rweights=weights[order],
+    )
 
-def load_graph() -> nx.MultiDiGraph:
+def _landmark_cache_path() -> Path:
+    return GRAPH_CACHE.with_name(GRAPH_CACHE.stem + ".landmarks.npz")
+
+def _pick_landmarks(k: int) -> List[int]:
+    """Farthest-point sampling (haversine) over node indices."""
+    n = len(_node_ids)
+    if n == 0:
+        return []
+    lat0, lon0 = float(_node_lat_rad.mean()), float(_node_lon_rad.mean())
+
+    def hav_a(i_lat, i_lon):
+        return (np.sin((_node_lat_rad - i_lat)*0.5)**2
+                + math.cos(i_lat)*_node_cos_lat*np.sin((_node_lon_rad - i_lon)*0.5)**2)
+
+    # Start from the node farthest from the centroid, then keep adding the node
+    # farthest from everything picked so far.
+    picked = [int(np.argmax(hav_a(lat0, lon0)))]
+    min_a = hav_a(_node_lat_rad[picked[0]], _node_lon_rad[picked[0]])
+    while len(picked) < min(k, n):
+        i = int(np.argmax(min_a))
+        picked.append(i)
+        min_a = np.minimum(min_a, hav_a(_node_lat_rad[i], _node_lon_rad[i]))
+    return picked
+
+def _landmark_distances(G: nx.DiGraph, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (lm_from, lm_to) for k landmarks, loaded from the .npz next to the GraphML
+    when it matches this graph, else computed with one Dijkstra per landmark and
+    direction and written back.
+    """
+    cache = _landmark_cache_path()
+    ids = np.asarray([str(n) for n in _node_ids])
+    src_mtime = GRAPH_CACHE.stat().st_mtime
+    if cache.exists():
+        try:
+            with np.load(cache) as z:
+                if (float(z["src_mtime"]) == src_mtime and z["lm_from"].shape[1] == k
+                        and np.array_equal(z["node_ids"], ids)):
+                    return z["lm_from"], z["lm_to"]
+        except Exception:
+            pass  # unreadable/old cache: recompute
+
+    n = len(_node_ids)
+    lm_from = np.full((n, k), np.nan, dtype=np.float32)
+    lm_to = np.full((n, k), np.nan, dtype=np.float32)
+    R = G.reverse(copy=False)
+    id_to_idx = _id2idx
+    for j, li in enumerate(_pick_landmarks(k)):
+        for graph, out in ((G, lm_from), (R, lm_to)):
+            dist = nx.single_source_dijkstra_path_length(graph, _node_ids[li], weight="length")
+            rows = np.fromiter((id_to_idx[v] for v in dist), dtype=np.int64, count=len(dist))
+            out[rows, j] = np.fromiter(dist.values(), dtype=np.float64, count=len(dist))
+    try:
+        np.savez(cache, node_ids=ids, lm_from=lm_from, lm_to=lm_to, src_mtime=src_mtime)
+    except OSError:
+        pass  # read-only checkout: just recompute next start
+    return lm_from, lm_to
+
+def _graph_bundle_path() -> Path:
+    return GRAPH_CACHE.with_suffix(".npz")
+
+def _bundle_is_fresh(bundle: Path) -> bool:
+    """Usable unless the GraphML it was converted from has been updated since."""
+    if not bundle.exists():
+        return False
+    return not GRAPH_CACHE.exists() or GRAPH_CACHE.stat().st_mtime <= bundle.stat().st_mtime
+
+def save_graph_bundle(G: Union[nx.DiGraph, GraphBundle], path: Optional[Path] = None) -> Path:
+    """
+    Write the graph returned by load_graph (WCC-filtered, parallel edges collapsed)
+    as flat arrays: node ids/coords, directed and undirected CSR, ALT landmarks.
+    Node ids are stored as strings, which is what read_graphml yields anyway.
+    """
+    path = path or _graph_bundle_path()
+    csr, ucsr = G.graph["_csr"], G.graph["_undirected"].graph["_csr"]
+    np.savez(
+        path,
+        node_ids=np.asarray([str(n) for n in csr.node_ids]),
+        # exact float64 coords in csr.node_ids order, as kept by _prep_node_arrays
+        lat=np.asarray(_node_lat, dtype=np.float64),
+        lon=np.asarray(_node_lon, dtype=np.float64),
+        indptr=csr.indptr, indices=csr.indices, weights=csr.weights,
+        uindptr=ucsr.indptr, uindices=ucsr.indices, uweights=ucsr.weights,
+        lm_from=csr.lm_from, lm_to=csr.lm_to,
+    )
+    return path
+
+class GraphBundle:
+    """
+    What load_graph returns from a bundle instead of a DiGraph: routing only reads
+    graph["_csr"] and graph["_undirected"].graph["_csr"] at request time, so the
+    networkx graphs are never built. Use load_graph(prefer_bundle=False) for those.
+    """
+    __slots__ = ("graph",)
+
+    def __init__(self, csr: CSRGraph, undirected: Optional[GraphBundle] = None):
+        self.graph: Dict = {"_csr": csr}
+        if undirected is not None:
+            self.graph["_undirected"] = undirected
+
+def _graph_from_bundle(bundle: Path) -> GraphBundle:
+    """
+    Rebuild load_graph's CSRs and lookup arrays from a bundle written by
+    save_graph_bundle: no XML parsing, float casting, WCC, landmark Dijkstras or
+    networkx graphs. (.npz members can't be memory-mapped, so this is a plain load.)
+    """
+    with np.load(bundle) as z:
+        b = {k: z[k] for k in z.files}
+    _prep_node_arrays_from(b["node_ids"].tolist(), b["lat"].tolist(), b["lon"].tolist())
+    csr = _csr_from_arrays(b["indptr"], b["indices"], b["weights"])._replace(
+        lm_from=b["lm_from"], lm_to=b["lm_to"])
+    ucsr = _csr_from_arrays(b["uindptr"], b["uindices"], b["uweights"])
+    return GraphBundle(csr, GraphBundle(ucsr))
+
+def _freeze_arrays(G: Union[nx.DiGraph, GraphBundle]) -> None:
+    """Mark the shared lookup arrays read-only so request threads can share them without locks."""
+    arrays = [_node_lat_rad, _node_lon_rad, _node_cos_lat, _coord_arr]
+    for csr in (G.graph["_csr"], G.graph["_undirected"].graph["_csr"]):
+        arrays.extend(a for a in csr if isinstance(a, np.ndarray))
+    for a in arrays:
+        a.setflags(write=False)
+
+def load_graph(prefer_bundle: bool = True) -> Union[nx.DiGraph, GraphBundle]:
+    """
+    Load the KL road graph, preferring the binary bundle next to the GraphML
+    (see scripts/convert_graph.py, returns a GraphBundle) and parsing the
+    GraphML into a DiGraph only if it is missing or stale.
+    """
+    bundle = _graph_bundle_path()
+    if prefer_bundle and _bundle_is_fresh(bundle):
+        G = _graph_from_bundle(bundle)
+        _freeze_arrays(G)
+        return G
     if not GRAPH_CACHE.exists():
-        raise FileNotFoundError(f"Missing {GRAPH_CACHE.name}. Provide a pre-cached GraphML for KL roads.")
+        raise FileNotFoundError(
+            f"Missing {GRAPH_CACHE.name}. Provide a pre-cached GraphML for KL roads "
+            f"(or a {bundle.name} bundle from scripts/convert_graph.py)."
+        )
     G = nx.read_graphml(GRAPH_CACHE)
     if not isinstance(G, nx.MultiDiGraph):
         G = nx.MultiDiGraph(G)
@@ -59,17 +334,40 @@ def load_graph() -> nx.MultiDiGraph:
         wccs = list(nx.weakly_connected_components(G))
         if len(wccs) > 1:
             largest = max(wccs, key=len)
-            G = G.subgraph(largest).copy()
+            G = G.subgraph(largest)
+
+    # Static graph: resolve min(length) over parallel edges once, not per request
+    G = _collapse_parallel_edges(G)
 
+    # Static for the process lifetime: build the undirected fallback once here
+    G.graph["_undirected"] = _compressed_undirected(G)
     _prep_node_arrays(G)
+    lm_from, lm_to = _landmark_distances(G, N_LANDMARKS)
+    G.graph["_csr"] = _build_csr(G)._replace(lm_from=lm_from, lm_to=lm_to)
+    # No landmarks on the undirected fallback: ignoring one-ways makes it shorter
+    # than G, so G's ALT bounds would overestimate there.
+    G.graph["_undirected"].graph["_csr"] = _build_csr(G.graph["_undirected"])
+    _freeze_arrays(G)
     return G
 
-def nearest_node(G: nx.MultiDiGraph, lat: float, lon: float):
-    """Pure-Python nearest node using haversine (no sklearn/osmnx)."""
-    best_idx, best_d = 0, float("inf")
-    for i in range(len(_node_ids)):
-        # arrays are floats already
-        d = _haversine_m(lat, lon, _node_lat[i], _node_lon[i])
-        if d < best_d:
-            best_d, best_idx = d, i
-    return _node_ids[best_idx]
+def nearest_node(G: nx.DiGraph, lat: float, lon: float):
+    """Nearest node via the prebuilt spatial index (linear haversine scan if none)."""
+    if BallTree is not None and _node_tree is not None:
+        _, idx = _node_tree.query(np.radians([[lat, lon]]), k=1)
+        return _node_ids_arr[int(idx[0, 0])]
+    if _node_tree is not None:
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        k = min(_KDTREE_CANDIDATES, len(_node_ids))
+        _, idx = _node_tree.query([lat_r, lon_r * _proj_cos_lat0], k=k)
+        # The projection is approximate: re-rank a few candidates on the true haversine.
+        best = min(np.atleast_1d(idx), key=lambda i: _haversine_rank(lat, lon, _node_lat[i], _node_lon[i]))
+        return _node_ids_arr[int(best)]
+    if HAVE_NUMBA:
+        return _node_ids[int(nearest_idx(lat, lon, _node_lat_rad, _node_lon_rad, _node_cos_lat))]
+
+    # Vectorized scan; argmin of the haversine 'a' term == argmin of distance
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    dphi = _node_lat_rad - lat_r
+    dlmb = _node_lon_rad - lon_r
+    a = np.sin(dphi*0.5)**2 + math.cos(lat_r)*_node_cos_lat*np.sin(dlmb*0.5)**2
+    return _node_ids[int(np.argmin(a))]
@@ -1,93 +1,241 @@
 from __future__ import annotations
+from bisect import bisect_left
+from heapq import heappush, heappop
+from itertools import count
 from typing import List, Tuple
-import math
 import networkx as nx
+import numpy as np
 import folium
 
-def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371000.0
-    p1, p2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlmb = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dlmb/2)**2
-    return 2*R*math.asin(math.sqrt(a))
+from _kernels import hav, potential_batch
+
+# Jitted when numba is installed; called once per A* expansion.
+haversine_m = hav
 
 def _heuristic_for(G: nx.Graph):
+    """
+    Haversine h(u, v) from the node dicts (load_graph already cast 'y'/'x').
+    Only used for graphs without a CSR; the CSR A* reads coordinates by index
+    in potential_batch instead.
+    """
+    nodes = G.nodes
     def h(u, v):
-        yu, xu = float(G.nodes[u]["y"]), float(G.nodes[u]["x"])
-        yv, xv = float(G.nodes[v]["y"]), float(G.nodes[v]["x"])
-        return haversine_m(yu, xu, yv, xv)
+        du, dv = nodes[u], nodes[v]
+        return haversine_m(du["y"], du["x"], dv["y"], dv["x"])
     return h
 
-def _compressed_undirected(G: nx.MultiDiGraph) -> nx.Graph:
+def _astar_path_fast(G: nx.Graph, source, target, heuristic) -> List:
+    """
+    nx.astar_path (networkx 3.3) specialised for the 'length' weight:
+    neighbours come straight from G._adj and the min over parallel edges is
+    inlined instead of going through a generic weight callback.
+    """
+    if source not in G or target not in G:
+        raise nx.NodeNotFound(f"Either source {source} or target {target} is not in G")
+    multigraph = G.is_multigraph()
+    G_succ = G._adj
+    c = count()
+    queue = [(0, next(c), source, 0, None)]
+    enqueued = {}  # node -> (best queued cost, heuristic)
+    explored = {}  # node -> parent
+    while queue:
+        _, __, curnode, dist, parent = heappop(queue)
+        if curnode == target:
+            path = [curnode]
+            node = parent
+            while node is not None:
+                path.append(node)
+                node = explored[node]
+            path.reverse()
+            return path
+        if curnode in explored:
+            # Already expanded the source, or reached again with a worse cost
+            if explored[curnode] is None:
+                continue
+            qcost, h = enqueued[curnode]
+            if qcost < dist:
+                continue
+        explored[curnode] = parent
+
+        for neighbor, w in G_succ[curnode].items():
+            if multigraph:
+                cost = min(attr["length"] for attr in w.values())
+            else:
+                cost = w["length"]
+            ncost = dist + cost
+            if neighbor in enqueued:
+                qcost, h = enqueued[neighbor]
+                if qcost <= ncost:
+                    continue
+            else:
+                h = heuristic(neighbor, target)
+            enqueued[neighbor] = ncost, h
+            heappush(queue, (ncost + h, next(c), neighbor, ncost, curnode))
+    raise nx.NetworkXNoPath(f"Node {target} not reachable from {source}")
+
+def _no_landmarks(n: int) -> np.ndarray:
+    # read-only like graph_loader's arrays, so the kernel reuses one compiled signature
+    empty = np.empty((n, 0), dtype=np.float32)
+    empty.setflags(write=False)
+    return empty
+
+def _astar_csr(csr, src_idx: int, dst_idx: int) -> List[int]:
     """
-    Make an undirected, weighted view where each edge (u,v) has weight=min length
-    across any parallel directed edges between u and v.
+    Bidirectional A* over the CSR arrays built by graph_loader; returns a path of
+    node indices. Both searches use the average potential from _csr_potential
+    (forward key g + p, backward key g - p), which keeps reduced costs
+    non-negative, so we can stop once top_f + top_b >= mu.
+    Per-node state is dense (indexed by node index, no dict churn), and the
+    potential for a row's unseen neighbours is computed in one batched call.
     """
-    UG = nx.Graph()
-    # copy node coordinates
-    for n, d in G.nodes(data=True):
-        UG.add_node(n, y=float(d["y"]), x=float(d["x"]))
-    for u, v, d in G.edges(data=True):
-        w = float(d.get("length", float("inf")))
-        if UG.has_edge(u, v):
-            if w < float(UG[u][v]["length"]):
-                UG[u][v]["length"] = w
-        else:
-            UG.add_edge(u, v, length=w)
-    return UG
-
-def astar_shortest_path(G: nx.MultiDiGraph, source, target) -> List:
+    if src_idx == dst_idx:
+        return [src_idx]
+    n = len(csr.lat)
+    lat, lon = csr.lat, csr.lon
+    if csr.lm_from is not None:
+        lm_from, lm_to = csr.lm_from, csr.lm_to
+    else:
+        lm_from = lm_to = _no_landmarks(n)
+
+    def p(v: List[int]) -> List[float]:
+        return potential_batch(np.array(v), lat, lon, lm_from, lm_to, src_idx, dst_idx).tolist()
+
+    pot: List = [None] * n  # memoized p(v); both searches ask for the same nodes
+    pot[src_idx], pot[dst_idx] = p([src_idx, dst_idx])
+
+    inf = float("inf")
+    g = ([inf] * n, [inf] * n)
+    g[0][src_idx] = 0.0
+    g[1][dst_idx] = 0.0
+    parent = ([-1] * n, [-1] * n)
+    settled = ([False] * n, [False] * n)
+    heaps = ([(pot[src_idx], src_idx)], [(-pot[dst_idx], dst_idx)])
+    adj = ((csr.indptr, csr.indices, csr.weights), (csr.rindptr, csr.rindices, csr.rweights))
+    mu, meet = inf, -1
+
+    while True:
+        for d in (0, 1):  # drop stale heap tops so the stopping test is tight
+            heap, done = heaps[d], settled[d]
+            while heap and done[heap[0][1]]:
+                heappop(heap)
+        if not heaps[0] or not heaps[1]:
+            break
+        if heaps[0][0][0] + heaps[1][0][0] >= mu:
+            break
+
+        d = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        sign = 1.0 if d == 0 else -1.0
+        _, u = heappop(heaps[d])
+        settled[d][u] = True
+        g_d, g_o, par, heap = g[d], g[1 - d], parent[d], heaps[d]
+        g_u = g_d[u]
+        ptr, idx, wts = adj[d]
+        lo, hi = ptr[u], ptr[u + 1]
+        nbrs = idx[lo:hi].tolist()
+        unseen = [v for v in nbrs if pot[v] is None]
+        if unseen:
+            for v, pv in zip(unseen, p(unseen)):
+                pot[v] = pv
+        for v, w in zip(nbrs, wts[lo:hi].tolist()):
+            ng = g_u + w
+            if ng < g_d[v]:
+                g_d[v] = ng
+                par[v] = u
+                heappush(heap, (ng + sign * pot[v], v))
+                if ng + g_o[v] < mu:
+                    mu, meet = ng + g_o[v], v
+
+    if meet == -1:
+        raise nx.NetworkXNoPath(f"Node index {dst_idx} not reachable from {src_idx}")
+    path = []
+    node = meet
+    while node != -1:
+        path.append(node)
+        node = parent[0][node]
+    path.reverse()
+    node = parent[1][meet]
+    while node != -1:
+        path.append(node)
+        node = parent[1][node]
+    return path
+
+def _astar_on(G: nx.Graph, source, target) -> List:
+    """Dispatch to the CSR search when graph_loader attached one, else the dict-based A*."""
+    csr = G.graph.get("_csr")
+    if csr is None:
+        return _astar_path_fast(G, source, target, _heuristic_for(G))
+    if source not in csr.id_to_idx or target not in csr.id_to_idx:
+        raise nx.NodeNotFound(f"Either source {source} or target {target} is not in G")
+    idx_path = _astar_csr(csr, csr.id_to_idx[source], csr.id_to_idx[target])
+    return csr.node_ids[idx_path].tolist()
+
+def astar_shortest_path(G: nx.DiGraph, source, target) -> List:
     """
     Try directed A* first; if no path, fall back to undirected compressed graph.
     """
     try:
-        return nx.astar_path(G, source, target, heuristic=_heuristic_for(G), weight="length")
+        return _astar_on(G, source, target)
     except (nx.NetworkXNoPath, nx.NodeNotFound):
         # Fall back to undirected (ignores one-way direction, but finds connectivity)
-        UG = _compressed_undirected(G)
-        return nx.astar_path(UG, source, target, heuristic=_heuristic_for(UG), weight="length")
+        return _astar_on(G.graph["_undirected"], source, target)
+
+def _edge_weight(csr, u_idx: int, v_idx: int) -> float:
+    """CSR weight of u->v (already the min over parallel edges), or inf if absent."""
+    lo, hi = int(csr.indptr[u_idx]), int(csr.indptr[u_idx + 1])
+    j = bisect_left(csr.indices, v_idx, lo, hi)  # rows are sorted by neighbour index
+    if j < hi and csr.indices[j] == v_idx:
+        return float(csr.weights[j])
+    return float("inf")
 
-def route_total_length_m(G: nx.MultiDiGraph, route: List) -> float:
+def route_total_length_m(G: nx.DiGraph, route: List) -> float:
+    csr = G.graph.get("_csr")
     total = 0.0
+    if csr is not None:
+        id_to_idx = csr.id_to_idx
+        for u, v in zip(route[:-1], route[1:]):
+            ui, vi = id_to_idx[u], id_to_idx[v]
+            w = _edge_weight(csr, ui, vi)
+            if w == float("inf"):
+                # undirected fallback may have used (u,v) against its direction
+                w = _edge_weight(csr, vi, ui)
+            if w != float("inf"):
+                total += w
+        return total
+
+    # load_graph already collapsed parallel edges to their min 'length'
+    adj = G._adj
     for u, v in zip(route[:-1], route[1:]):
-        # choose shortest parallel edge if present
-        min_len = float("inf")
-        if G.has_edge(u, v):
-            for _, edge in G[u][v].items():
-                try:
-                    length = float(edge.get("length", float("inf")))
-                    if length < min_len:
-                        min_len = length
-                except Exception:
-                    pass
-        else:
-            # if route came from undirected fallback but (u,v) not present in G directed,
-            # add symmetric check
-            if G.has_edge(v, u):
-                for _, edge in G[v][u].items():
-                    try:
-                        length = float(edge.get("length", float("inf")))
-                        if length < min_len:
-                            min_len = length
-                    except Exception:
-                        pass
-        if min_len != float("inf"):
-            total += min_len
-    return float(total)
-
-def route_coordinates(G: nx.MultiDiGraph, route: List) -> List[Tuple[float, float]]:
-    return [(float(G.nodes[n]["y"]), float(G.nodes[n]["x"])) for n in route]
+        if v in adj[u]:
+            total += adj[u][v]["length"]
+        elif u in adj[v]:
+            total += adj[v][u]["length"]
+    return total
+
+def route_coordinates(G: nx.DiGraph, route: List) -> List[Tuple[float, float]]:
+    csr = G.graph.get("_csr")
+    if csr is None:
+        return [(float(G.nodes[n]["y"]), float(G.nodes[n]["x"])) for n in route]
+    idx = [csr.id_to_idx[n] for n in route]
+    return [(lat, lon) for lat, lon in csr.coords[idx].tolist()]
+
+def _route_style(_feature) -> dict:
+    return {"weight": 6, "opacity": 0.8}
 
 def render_folium_map(coords: List[Tuple[float, float]], a_label: str, b_label: str, out_html_path: str) -> None:
     if not coords:
         raise ValueError("Empty route coordinates.")
-    lat_vals = [float(c[0]) for c in coords]
-    lon_vals = [float(c[1]) for c in coords]
-    center_lat = sum(lat_vals) / float(len(lat_vals))
-    center_lon = sum(lon_vals) / float(len(lon_vals))
+    coords_arr = np.asarray(coords, dtype=np.float64)
+    center_lat, center_lon = coords_arr.mean(axis=0).tolist()
     m = folium.Map(location=[center_lat, center_lon], zoom_start=13, control_scale=True)
-    folium.PolyLine(list(zip(lat_vals, lon_vals)), weight=6, opacity=0.8).add_to(m)
-    folium.Marker((lat_vals[0], lon_vals[0]), tooltip="Point A", popup=a_label).add_to(m)
-    folium.Marker((lat_vals[-1], lon_vals[-1]), tooltip="Point B", popup=b_label).add_to(m)
+    # One GeoJSON LineString ([lon, lat] order) instead of a PolyLine, which
+    # validates and serializes every point in Python; a dict is embedded as-is.
+    route_geojson = {
+        "type": "Feature",
+        "properties": {},
+        "geometry": {"type": "LineString", "coordinates": coords_arr[:, ::-1].tolist()},
+    }
+    folium.GeoJson(route_geojson, style_function=_route_style).add_to(m)
+    (lat_a, lon_a), (lat_b, lon_b) = coords_arr[0].tolist(), coords_arr[-1].tolist()
+    folium.Marker((lat_a, lon_a), tooltip="Point A", popup=a_label).add_to(m)
+    folium.Marker((lat_b, lon_b), tooltip="Point B", popup=b_label).add_to(m)
     m.save(out_html_path)
@@ -0,0 +1,29 @@
+"""
+Convert backend/kl_drive.graphml into the kl_drive.npz bundle that
+graph_loader.load_graph prefers at startup (no XML parse, no landmark Dijkstras).
+
+Run from the repo root after updating the GraphML:
+    python scripts/convert_graph.py
+"""
+from __future__ import annotations
+from pathlib import Path
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import graph_loader  # noqa: E402
+
+
+def main() -> None:
+    t0 = time.perf_counter()
+    G = graph_loader.load_graph(prefer_bundle=False)
+    out = graph_loader.save_graph_bundle(G)
+    print(
+        f"Wrote {out} ({G.number_of_nodes()} nodes, {G.number_of_edges()} edges) "
+        f"in {time.perf_counter() - t0:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()